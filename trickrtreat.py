@@ -1,11 +1,16 @@
-import RPi.GPIO as GPIO
+from gpiozero import Device, MotionSensor
+from gpiozero.pins.pigpio import PiGPIOFactory
 import vlc
-import time
 import os
+import threading
 
 # --- Configuration ---
 PIR_PIN = 17
 
+# --- Hardware Video Decoder ---
+# "v4l2_m2m" for Raspberry Pi OS Bookworm, "mmal" for legacy (Buster/Bullseye).
+VLC_HW_DECODER = "v4l2_m2m"
+
 # --- Video Time Configuration (in seconds) ---
 #--- IMPORTANT ---
 # Define the time segments for your single video file.
@@ -15,6 +20,13 @@ TRIGGER_START_S = 51  # Start of the motion-triggered section (e.g., 10 seconds)
 TRIGGER_END_S = 76    # End of the motion-triggered section (e.g., 25 seconds)
 
 
+# --- Display Environment ---
+# Make sure the player can find the desktop when started outside of it
+# (e.g. from a systemd service or over SSH).
+os.environ.setdefault("DISPLAY", ":0")
+# Under sudo, use the desktop user's session rather than root's
+os.environ.setdefault("XDG_RUNTIME_DIR", f"/run/user/{os.environ.get('SUDO_UID', 1000)}")
+
 # --- File Path ---
 # --- IMPORTANT ---
 # Create one video file named 'combined_video.mp4' and place it
@@ -22,45 +34,46 @@ TRIGGER_END_S = 76    # End of the motion-triggered section (e.g., 25 seconds)
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 VIDEO_PATH = os.path.join(SCRIPT_DIR, "combined_video.mp4")
 
-# --- Global variable to signal motion detection ---
-motion_detected_flag = False
+# --- Event to signal motion detection ---
+motion_event = threading.Event()
+# --- Event to signal that VLC played to the end of the file ---
+end_reached_event = threading.Event()
 
-def motion_callback(channel):
+def motion_callback(sensor):
     """
-    Callback function executed on a PIR sensor interrupt.
-    Sets a global flag to indicate motion was detected.
+    Callback function executed when the PIR sensor detects motion.
+    Sets an event to indicate motion was detected.
     """
-    global motion_detected_flag
     # No need to print here, as it can slow down the interrupt handler.
     # The main loop will provide feedback.
-    motion_detected_flag = True
+    motion_event.set()
 
 def main():
     """
     Main function to handle video playback based on PIR sensor input.
     """
-    global motion_detected_flag
-
     # --- Convert times from seconds to milliseconds for VLC ---
     IDLE_START_MS = IDLE_START_S * 1000
     IDLE_END_MS = IDLE_END_S * 1000
     TRIGGER_START_MS = TRIGGER_START_S * 1000
     TRIGGER_END_MS = TRIGGER_END_S * 1000
 
-    # --- GPIO Setup ---
-    GPIO.setwarnings(False)
-    GPIO.setmode(GPIO.BCM)
-    GPIO.setup(PIR_PIN, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
+    # --- PIR Sensor Setup ---
+    # MotionSensor reads the pin 100 times a second from a background thread.
+    # Uses the pigpio backend, which requires the pigpio daemon (`sudo pigpiod`).
+    Device.pin_factory = PiGPIOFactory()
+    pir = MotionSensor(PIR_PIN, queue_len=1, sample_rate=100)
 
-    # Setup interrupt for motion detection. This is non-blocking.
-    # bouncetime avoids multiple rapid triggers from the same motion event.
-    GPIO.add_event_detect(PIR_PIN, GPIO.RISING, callback=motion_callback, bouncetime=500)
+    # Callback for motion detection. This is non-blocking, and only fires
+    # when the sensor goes from no-motion to motion, so a continuous motion
+    # event doesn't re-trigger.
+    pir.when_motion = motion_callback
 
     print("Sensor and video player initializing...")
 
     # --- VLC Instance Setup with Optimizations for Raspberry Pi ---
     vlc_instance = vlc.Instance(
-        '--codec=h264_mmal',
+        f'--avcodec-hw={VLC_HW_DECODER}',  # Decode on the VPU instead of the CPU
         '--fullscreen',
         '--no-osd',
         '--no-video-title-show'
@@ -69,8 +82,17 @@ def main():
     # Create a single media player
     player = vlc_instance.media_player_new()
     media = vlc_instance.media_new(VIDEO_PATH)
+    # Parse the MP4 headers now, so playback and the first seeks don't have to
+    media.parse()
     player.set_media(media)
 
+    # VLC stops at the end of the file and ignores set_time() from then on, so
+    # get told when that happens. libvlc must not be called from its own event
+    # callback, so just set an event and let the main loop restart playback.
+    player.event_manager().event_attach(
+        vlc.EventType.MediaPlayerEndReached, lambda event: end_reached_event.set()
+    )
+
     # Start playing the video
     player.play()
     # Set the initial position to the start of the idle loop
@@ -79,31 +101,50 @@ def main():
     current_state = 'IDLE'
     print(f"Setup complete. Starting IDLE loop ({IDLE_START_S}s to {IDLE_END_S}s).")
 
+    # Bind the methods used on every iteration to locals, so the loop
+    # doesn't repeat the attribute lookups 50 times a second.
+    get_time = player.get_time
+    set_time = player.set_time
+    motion_detected = motion_event.is_set
+    end_reached = end_reached_event.is_set
+    wait_for_motion = motion_event.wait
+
     try:
         while True:
+            # If the end of the file was reached (normally at the end of the
+            # trigger section), restart playback from the idle loop.
+            if end_reached():
+                end_reached_event.clear()
+                if current_state == 'TRIGGER':
+                    print(f"Trigger finished. Returning to IDLE loop.")
+                    current_state = 'IDLE'
+                player.stop()
+                player.play()
+                set_time(IDLE_START_MS)
+
             # Get current video time in milliseconds
-            current_time = player.get_time()
+            current_time = get_time()
 
             # --- State Machine Logic ---
 
             # Check if motion has been detected AND we are currently in the idle state.
             # This prevents the trigger section from restarting if motion continues.
-            if motion_detected_flag and current_state == 'IDLE':
+            if motion_detected() and current_state == 'IDLE':
                 current_state = 'TRIGGER'
-                player.set_time(TRIGGER_START_MS)
+                set_time(TRIGGER_START_MS)
                 print(f"Motion Detected! Playing TRIGGER section ({TRIGGER_START_S}s to {TRIGGER_END_S}s).")
-                motion_detected_flag = False  # Reset the flag so we don't re-trigger immediately
+                motion_event.clear()  # Reset the event so we don't re-trigger immediately
 
             # If motion is detected while the trigger video is already playing, just ignore it.
-            elif motion_detected_flag:
-                motion_detected_flag = False # Reset flag and do nothing.
+            elif motion_detected():
+                motion_event.clear() # Reset event and do nothing.
 
             # Handle the IDLE state (looping)
             if current_state == 'IDLE':
                 # If playback is past the idle section's end, or somehow before its start,
                 # loop it back to the beginning of the idle section.
                 if current_time >= IDLE_END_MS or current_time < IDLE_START_MS:
-                    player.set_time(IDLE_START_MS)
+                    set_time(IDLE_START_MS)
 
             # Handle the TRIGGER state (play once)
             elif current_state == 'TRIGGER':
@@ -111,17 +152,18 @@ def main():
                 if current_time >= TRIGGER_END_MS:
                     print(f"Trigger finished. Returning to IDLE loop.")
                     current_state = 'IDLE'
-                    player.set_time(IDLE_START_MS)
+                    set_time(IDLE_START_MS)
 
-            # Small delay to prevent this loop from using 100% CPU
-            time.sleep(0.02)
+            # Small delay to prevent this loop from using 100% CPU.
+            # Waiting on the event instead of sleeping wakes up right away on motion.
+            wait_for_motion(timeout=0.02)
 
     except KeyboardInterrupt:
         print("\nExiting program.")
     finally:
         if player.is_playing():
             player.stop()
-        GPIO.cleanup()
+        pir.close()
 
 
 if __name__ == '__main__':
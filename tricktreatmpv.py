@@ -1,9 +1,27 @@
-import RPi.GPIO as GPIO
+from gpiozero import Device, MotionSensor
+from gpiozero.pins.pigpio import PiGPIOFactory
 import time
 import os
 import subprocess
 import socket
-import json
+import threading
+import queue
+import itertools
+import re
+import signal
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+# orjson is considerably faster and works with bytes directly; fall back to
+# the standard library if it isn't installed.
+try:
+    import orjson
+    json_dumps = orjson.dumps
+    json_loads = orjson.loads
+except ImportError:
+    import json
+    def json_dumps(obj):
+        return json.dumps(obj).encode('utf-8')
+    json_loads = json.loads
 
 # --- Configuration ---
 PIR_PIN = 17
@@ -13,116 +31,350 @@ IDLE_START_S = 0
 IDLE_END_S = 50
 TRIGGER_START_S = 53
 TRIGGER_END_S = 76
+# The trigger section runs to the end of the file and finishes when MPV
+# reports end-of-file. This many seconds past its expected length, give up
+# waiting and return to idle anyway.
+TRIGGER_TIMEOUT_MARGIN_S = 2
+
+# --- CPU Scheduling ---
+# Core reserved for this script (add isolcpus=3 to /boot/cmdline.txt to keep
+# everything else off it), and the cores MPV is pinned to.
+CONTROL_CPU = 3
+MPV_CPUS = "0-2"
+# SCHED_FIFO priority for this script's threads
+RT_PRIORITY = 50
+
+# --- Display Environment ---
+# Make sure the player can find the desktop when started outside of it
+# (e.g. from a systemd service or over SSH).
+os.environ.setdefault("DISPLAY", ":0")
+# Under sudo, use the desktop user's session rather than root's
+os.environ.setdefault("XDG_RUNTIME_DIR", f"/run/user/{os.environ.get('SUDO_UID', 1000)}")
 
 # --- File Paths ---
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 VIDEO_PATH = os.path.join(SCRIPT_DIR, "trickrtreatdoor.mp4")
 # A temporary file used for communication between this script and MPV
 SOCKET_PATH = "/tmp/mpv.sock"
+# How long to wait for MPV to create the socket at startup
+MPV_STARTUP_TIMEOUT_S = 10
+# Long-lived connection to the MPV socket, reused for every command
+_mpv_sock = None
+
+# Inputs to the state machine as (name, value) pairs: observed property
+# changes from the reader thread, ('motion', None) from the PIR sensor, and
+# ('mpv-exit', returncode) from the exit watcher thread
+events = queue.Queue()
+# (Future, command) for requests still waiting on a reply, keyed by
+# request_id; the reader thread resolves the Futures as the replies come in
+_pending = {}
+_pending_lock = threading.Lock()
+_request_ids = itertools.count(1)
+# Fields the reader thread picks out of raw MPV messages without decoding them
+_EVENT_RE = re.compile(rb'"event"\s*:\s*"([^"]*)"')
+_REQUEST_ID_RE = re.compile(rb'"request_id"\s*:\s*(\d+)')
+
+# --- Pre-serialized commands sent on every state transition ---
+# MPV's IPC socket also accepts plain input.conf-style command lines. They are
+# shorter than the JSON form, need no serializing, and get no reply.
+# That also means MPV reports no errors for them: a typo in one of these
+# lines fails silently.
+_PAYLOAD_SEEK_IDLE = f"seek {IDLE_START_S} absolute\n".encode()
+_PAYLOAD_SEEK_TRIGGER = f"seek {TRIGGER_START_S} absolute\n".encode()
+_PAYLOAD_LOOP_INF = b"set loop-file inf\n"
+_PAYLOAD_LOOP_NO = b"set loop-file no\n"
+_PAYLOAD_UNPAUSE = b"set pause no\n"
+_PAYLOAD_QUIT = b"quit\n"
+# MPV loops the idle section itself with an A-B loop
+_PAYLOAD_AB_LOOP_IDLE = f"set ab-loop-a {IDLE_START_S}\nset ab-loop-b {IDLE_END_S}\n".encode()
+_PAYLOAD_AB_LOOP_OFF = b"set ab-loop-a no\nset ab-loop-b no\n"
+# MPV reads commands line by line, so each transition goes out as one write
+_PAYLOAD_SWITCH_TO_TRIGGER = _PAYLOAD_AB_LOOP_OFF + _PAYLOAD_LOOP_NO + _PAYLOAD_SEEK_TRIGGER
+# --keep-open pauses on the last frame, so resume playback as well
+_PAYLOAD_SWITCH_TO_IDLE = (_PAYLOAD_AB_LOOP_IDLE + _PAYLOAD_LOOP_INF + _PAYLOAD_SEEK_IDLE
+                           + _PAYLOAD_UNPAUSE)
+
+def motion_callback(sensor):
+    """Callback function executed when the PIR sensor detects motion."""
+    events.put(('motion', None))
+
+def remove_socket_file():
+    """Removes the MPV socket file, if there is one."""
+    # Just try it; checking os.path.exists first is an extra stat() call
+    try:
+        os.remove(SOCKET_PATH)
+    except FileNotFoundError:
+        pass
 
-# --- Global variable to signal motion detection ---
-motion_detected_flag = False
+def read_mpv_messages(sock):
+    """Reader thread: routes MPV replies and property-change events."""
+    try:
+        with sock.makefile('rb') as reader:
+            # MPV messages are newline-terminated JSON strings
+            for line in reader:
+                try:
+                    route_mpv_message(line)
+                except ValueError as e:
+                    # Skip just this line, so one bad message can't stop
+                    # event delivery
+                    print(f"Bad message from MPV: {e}")
+    except OSError:
+        # The socket was closed underneath us; MPV is going away
+        pass
+
+def route_mpv_message(line):
+    """Hands one raw MPV message to the event queue or a waiting request."""
+    # Most lines are events we don't observe or replies nobody waits for;
+    # recognize those from the raw bytes and only decode the lines we use.
+    event = _EVENT_RE.search(line)
+    if event is not None:
+        if event.group(1) == b'property-change':
+            message = json_loads(line)
+            events.put((message.get('name'), message.get('data')))
+        return
+    # Anything else is the reply to a request_mpv() request
+    request_id = _REQUEST_ID_RE.search(line)
+    if request_id is not None:
+        with _pending_lock:
+            pending = _pending.get(int(request_id.group(1)))
+        if pending is not None:
+            pending[0].set_result(json_loads(line))
+
+class MPVStartupError(Exception):
+    """Raised when MPV exits or never opens its IPC socket during startup."""
 
-def motion_callback(channel):
-    """Callback function executed on PIR sensor interrupt."""
-    global motion_detected_flag
-    motion_detected_flag = True
+def connect_mpv(timeout=0, mpv_process=None):
+    """
+    Opens the persistent connection to the MPV socket, retrying with
+    exponential backoff for up to `timeout` seconds while MPV starts up.
+    If `mpv_process` is given, gives up as soon as it exits and reports
+    either failure as MPVStartupError.
+    """
+    global _mpv_sock
+    deadline = time.monotonic() + timeout
+    delay = 0.01
+    while True:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(SOCKET_PATH)
+            break
+        except (FileNotFoundError, ConnectionRefusedError):
+            # MPV hasn't created the socket yet
+            sock.close()
+            if mpv_process is not None:
+                if mpv_process.poll() is not None:
+                    raise MPVStartupError(
+                        f"MPV exited during startup (exit code {mpv_process.returncode})")
+                if time.monotonic() >= deadline:
+                    raise MPVStartupError(f"MPV didn't open {SOCKET_PATH} within {timeout}s")
+            elif time.monotonic() >= deadline:
+                raise
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+    _mpv_sock = sock
+    threading.Thread(target=read_mpv_messages, args=(_mpv_sock,), daemon=True).start()
+    # Ask MPV to push end-of-file changes instead of polling for them
+    wait_for_reply(request_mpv(["observe_property", 1, "eof-reached"]))
 
-def send_mpv_command(command):
-    """Sends a command to the MPV socket."""
+def send_mpv_bytes(payload):
+    """Sends already-serialized commands to MPV without waiting for replies."""
     try:
-        # Create a Unix domain socket
-        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client_socket:
-            client_socket.connect(SOCKET_PATH)
-            # MPV commands are newline-terminated JSON strings
-            client_socket.sendall(json.dumps(command).encode('utf-8') + b'\n')
-            # Read the response
-            response = client_socket.recv(4096)
-            return json.loads(response)
+        try:
+            _mpv_sock.sendall(payload)
+        except BrokenPipeError:
+            # MPV dropped the connection; reconnect once and retry
+            _mpv_sock.close()
+            connect_mpv()
+            _mpv_sock.sendall(payload)
+        return True
     except (ConnectionRefusedError, FileNotFoundError):
-        # This can happen briefly at startup before MPV is ready
-        return None
+        # MPV has gone away and the reconnect failed, e.g. during shutdown
+        return False
     except Exception as e:
         print(f"Error communicating with MPV: {e}")
+        return False
+
+def request_mpv(command):
+    """
+    Sends a command to MPV tagged with a new request_id, and returns that id
+    for wait_for_reply().
+    """
+    request_id = next(_request_ids)
+    with _pending_lock:
+        _pending[request_id] = (Future(), command)
+    send_mpv_bytes(json_dumps({"command": command, "request_id": request_id}) + b'\n')
+    return request_id
+
+def wait_for_reply(request_id, timeout=1):
+    """
+    Waits for the reply to a request_mpv() request and reports it if the
+    command failed. Returns the reply, or None if there was none.
+    """
+    with _pending_lock:
+        future, command = _pending[request_id]
+    try:
+        response = future.result(timeout=timeout)
+    except FutureTimeoutError:
+        print(f"No reply from MPV to {command}")
         return None
+    finally:
+        with _pending_lock:
+            del _pending[request_id]
+    if response.get('error') != 'success':
+        print(f"MPV command {command} failed: {response.get('error')}")
+    return response
+
+def switch_to_trigger():
+    """Seeks to the trigger section and lets it play through to the end."""
+    send_mpv_bytes(_PAYLOAD_SWITCH_TO_TRIGGER)
+
+def switch_to_idle():
+    """Seeks back to the idle section and resumes looping."""
+    send_mpv_bytes(_PAYLOAD_SWITCH_TO_IDLE)
+
+def watch_mpv_exit(mpv_process, wakeup_fd):
+    """Watcher thread: queues ('mpv-exit', returncode) once MPV has exited."""
+    # Every signal the process receives writes a byte to wakeup_fd, so this
+    # sleeps until one arrives instead of polling MPV. Checking before the
+    # first read also covers MPV exiting before the signal was set up.
+    while mpv_process.poll() is None:
+        os.read(wakeup_fd, 512)
+    events.put(('mpv-exit', mpv_process.returncode))
+
+def set_realtime_priority():
+    """
+    Pins this process to CONTROL_CPU and runs it at SCHED_FIFO priority, so
+    MPV's decoding can't delay the reaction to motion. Falls back to a lower
+    nice value if real-time scheduling isn't permitted.
+    """
+    try:
+        os.sched_setaffinity(0, {CONTROL_CPU})
+    except OSError as e:
+        print(f"Could not pin to CPU {CONTROL_CPU}: {e}")
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(RT_PRIORITY))
+    except PermissionError:
+        try:
+            os.nice(-10)
+        except PermissionError:
+            print("Could not raise scheduling priority; run as root for lower motion latency.")
 
 def main():
     """Main function to launch MPV and handle video playback."""
-    global motion_detected_flag
-
-    # --- GPIO Setup ---
-    GPIO.setwarnings(False)
-    GPIO.setmode(GPIO.BCM)
-    GPIO.setup(PIR_PIN, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-    GPIO.add_event_detect(PIR_PIN, GPIO.RISING, callback=motion_callback, bouncetime=500)
 
     # --- Clean up old socket if it exists ---
-    if os.path.exists(SOCKET_PATH):
-        os.remove(SOCKET_PATH)
+    remove_socket_file()
 
     print("Launching MPV media player...")
 
     # --- Command to launch MPV ---
     mpv_command = [
+        'taskset', '-c', MPV_CPUS, # Keep MPV off the control core
         'mpv',
         VIDEO_PATH,
         '--fs',  # Fullscreen
         '--keep-open=yes', # Keep open after video finishes
+        '--force-window=immediate', # Create the window (and GL context) once, up front
         '--no-osc', # Disable the on-screen controller
         '--no-osd-bar', # Disable the on-screen display bar for seeking
         '--loop-file=inf', # Loop the whole file if it ever reaches the end
+        '--hwdec=auto-copy', # Decode on the VPU instead of the CPU
+        '--vo=gpu', # Render through the GPU
+        '--cache=no', # Local file, no need for a read-ahead cache
         f'--input-ipc-server={SOCKET_PATH}' # IPC socket for control
     ]
 
     # Launch MPV as a separate, non-blocking process
     mpv_process = subprocess.Popen(mpv_command)
 
-    # Wait a moment for MPV to start and create the socket
-    time.sleep(2)
-    print("MPV started. Initializing control loop.")
-
-    current_state = 'IDLE'
-    send_mpv_command({"command": ["seek", IDLE_START_S, "absolute"]})
-    print(f"Starting IDLE loop ({IDLE_START_S}s to {IDLE_END_S}s).")
+    pir = None
 
     try:
+        # --- Watch for MPV exiting ---
+        # The kernel sends SIGCHLD when MPV exits. A Python handler must be set
+        # for the wakeup fd to be written, but the work happens in the watcher.
+        wakeup_read_fd, wakeup_write_fd = os.pipe()
+        os.set_blocking(wakeup_write_fd, False)
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+        signal.set_wakeup_fd(wakeup_write_fd)
+        threading.Thread(target=watch_mpv_exit, args=(mpv_process, wakeup_read_fd),
+                         daemon=True).start()
+
+        # Raise our priority only now, so MPV doesn't inherit it. Threads started
+        # from here on (the MPV reader and the PIR callback) inherit it instead.
+        set_realtime_priority()
+
+        # Connect as soon as MPV has created the socket
+        connect_mpv(timeout=MPV_STARTUP_TIMEOUT_S, mpv_process=mpv_process)
+        print("MPV started. Initializing control loop.")
+
+        # --- PIR Sensor Setup (pigpio backend, requires `sudo pigpiod`) ---
+        Device.pin_factory = PiGPIOFactory()
+        pir = MotionSensor(PIR_PIN, queue_len=1, sample_rate=100)
+        pir.when_motion = motion_callback
+
+        current_state = 'IDLE'
+        send_mpv_bytes(_PAYLOAD_AB_LOOP_IDLE + _PAYLOAD_SEEK_IDLE)
+        print(f"Starting IDLE loop ({IDLE_START_S}s to {IDLE_END_S}s).")
+
+        eof_reached = False
+        trigger_deadline = 0
+
         while True:
-            # --- Get current video time from MPV ---
-            response = send_mpv_command({"command": ["get_property", "time-pos"]})
-            current_time = response.get('data', 0) if response else 0
+            # --- Block until motion or an MPV property change arrives ---
+            # MPV loops the idle section on its own, so there is nothing to do
+            # until then; in TRIGGER, wake up in time for the safety timeout.
+            timeout = None
+            if current_state == 'TRIGGER':
+                timeout = max(0, trigger_deadline - time.monotonic())
+            try:
+                name, data = events.get(timeout=timeout)
+            except queue.Empty:
+                name, data = None, None
 
             # --- State Machine Logic ---
-            if motion_detected_flag and current_state == 'IDLE':
+            if name == 'motion' and current_state == 'IDLE':
                 print(f"Motion Detected! Playing TRIGGER section ({TRIGGER_START_S}s to {TRIGGER_END_S}s).")
                 current_state = 'TRIGGER'
-                send_mpv_command({"command": ["seek", TRIGGER_START_S, "absolute"]})
-                motion_detected_flag = False
+                switch_to_trigger()
+                eof_reached = False
+                trigger_deadline = (time.monotonic() + TRIGGER_END_S - TRIGGER_START_S
+                                    + TRIGGER_TIMEOUT_MARGIN_S)
+
+            elif name == 'eof-reached':
+                eof_reached = bool(data)
 
-            elif motion_detected_flag:
-                motion_detected_flag = False # Ignore motion if not in IDLE state
+            elif name == 'mpv-exit':
+                print(f"MPV exited unexpectedly (exit code {data}). Exiting program.")
+                break
+
+            # Motion while not in IDLE state is ignored
 
             # --- Handle States ---
-            if current_state == 'IDLE':
-                if current_time >= IDLE_END_S or current_time < IDLE_START_S:
-                    send_mpv_command({"command": ["seek", IDLE_START_S, "absolute"]})
-            
-            elif current_state == 'TRIGGER':
-                if current_time >= TRIGGER_END_S:
+            if current_state == 'TRIGGER':
+                if eof_reached or time.monotonic() >= trigger_deadline:
                     print("Trigger finished. Returning to IDLE loop.")
                     current_state = 'IDLE'
-                    send_mpv_command({"command": ["seek", IDLE_START_S, "absolute"]})
-
-            time.sleep(0.02) # Prevent 100% CPU usage
+                    switch_to_idle()
 
     except KeyboardInterrupt:
         print("\nExiting program.")
+    except MPVStartupError as e:
+        print(f"Error: {e}")
     finally:
-        # Cleanly shut down MPV and GPIO
-        send_mpv_command({"command": ["quit"]})
+        # Our own quit command makes MPV exit too; that's expected here
+        signal.set_wakeup_fd(-1)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        # Cleanly shut down MPV and the PIR sensor. If setup failed before
+        # the connection was made, MPV can't be asked to quit, so stop it.
+        if _mpv_sock is None or not send_mpv_bytes(_PAYLOAD_QUIT):
+            mpv_process.terminate()
         mpv_process.wait()
-        GPIO.cleanup()
-        if os.path.exists(SOCKET_PATH):
-            os.remove(SOCKET_PATH)
+        if _mpv_sock is not None:
+            _mpv_sock.close()
+        if pir is not None:
+            pir.close()
+        remove_socket_file()
 
 if __name__ == '__main__':
     if not os.path.exists(VIDEO_PATH):